@@ -3,9 +3,45 @@ Flask Application Initialization
 Creates and configures the Flask app with Blueprints
 """
 
+import logging
+import logging.handlers
 import os
+from functools import partial
+import redis
 from flask import Flask, render_template
 from flask_cors import CORS
+from app.json_provider import OrjsonProvider
+from app.services.collapser import Collapser, SingleFlight
+from app.services.session_store import create_machine_store
+from app.services.transaction import transaction_service
+
+
+class FastFlask(Flask):
+    """Flask app that parses and serializes JSON with orjson"""
+    json_provider_class = OrjsonProvider
+
+
+def _configure_request_logging() -> None:
+    """
+    Keep the built-in server's per-request log lines off the hot path
+    Outside development, werkzeug only logs warnings unless ACCESS_LOG is set,
+    in which case access lines are buffered and written 1024 at a time
+    """
+    if os.environ.get('FLASK_ENV') == 'development':
+        return
+    
+    werkzeug_logger = logging.getLogger('werkzeug')
+    if not os.environ.get('ACCESS_LOG'):
+        werkzeug_logger.setLevel(logging.WARNING)
+        return
+    
+    werkzeug_logger.setLevel(logging.INFO)
+    # create_app() may run more than once per process; buffer through a single handler
+    if any(isinstance(handler, logging.handlers.MemoryHandler) for handler in werkzeug_logger.handlers):
+        return
+    werkzeug_logger.addHandler(logging.handlers.MemoryHandler(
+        capacity=1024, flushLevel=logging.WARNING, target=logging.StreamHandler()
+    ))
 
 
 def create_app():
@@ -17,13 +53,33 @@ def create_app():
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
     
     # Create Flask app with custom template and static folders
-    app = Flask(__name__,
-                template_folder=os.path.join(base_dir, 'templates'),
-                static_folder=os.path.join(base_dir, 'static'))
+    app = FastFlask(__name__,
+                    template_folder=os.path.join(base_dir, 'templates'),
+                    static_folder=os.path.join(base_dir, 'static'))
     
     # Configuration
     app.config['SECRET_KEY'] = 'vending-machine-secret-key-2025'
-    app.config['JSON_SORT_KEYS'] = False
+    
+    # Per-session machine state - shared through Redis when REDIS_URL is set
+    redis_url = os.environ.get('REDIS_URL')
+    redis_client = redis.Redis.from_url(redis_url, decode_responses=True) if redis_url else None
+    machine_store = create_machine_store(redis_client)
+    app.extensions['machine_store'] = machine_store
+    
+    # Coins arriving while a session's previous coin batch is being applied join the
+    # next batch, led by the first waiting request's thread; a lone coin applies at once
+    app.extensions['coin_collapser'] = Collapser(
+        partial(transaction_service.apply_coin_batch, machine_store)
+    )
+    
+    # /status polls arriving while a session's status is being computed share that
+    # result; a lone poll computes at once, with no batching window
+    app.extensions['status_flight'] = SingleFlight(
+        partial(transaction_service.status_json, machine_store)
+    )
+    
+    # No synchronous stderr write per request in production
+    _configure_request_logging()
     
     # Enable CORS for API endpoints
     CORS(app)
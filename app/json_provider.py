@@ -0,0 +1,19 @@
+"""
+JSON Provider
+Plugs orjson into Flask for request parsing and jsonify-style responses
+"""
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        """Serialize obj to a JSON string (Flask's formatting options are ignored)"""
+        return orjson.dumps(obj, default=self.default).decode()
+    
+    def loads(self, s, **kwargs):
+        """Parse a JSON document from str or bytes"""
+        return orjson.loads(s)
@@ -0,0 +1,48 @@
+"""
+Item Model
+Represents one product slot in the vending machine
+"""
+
+from dataclasses import dataclass
+from typing import Dict
+
+
+@dataclass
+class Item:
+    """
+    A product with its price and current stock
+    Slotted: attribute access is a fixed offset, no per-item __dict__
+    """
+    __slots__ = ('id', 'name', 'price_cents', 'stock', 'image')
+    
+    id: str
+    name: str
+    price_cents: int  # Integer cents - all price math stays exact
+    stock: int
+    image: str
+    
+    @classmethod
+    def from_spec(cls, spec: Dict) -> "Item":
+        """Build an item from a catalog entry (price given in dollars)"""
+        return cls(
+            id=spec["id"],
+            name=spec["name"],
+            price_cents=round(spec["price"] * 100),
+            stock=spec["stock"],
+            image=spec["image"]
+        )
+    
+    @property
+    def price(self) -> float:
+        """Price in dollars (JSON boundary only)"""
+        return self.price_cents / 100
+    
+    def to_dict(self) -> Dict:
+        """Plain dict for JSON responses, with the price in dollars"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "price": self.price,
+            "stock": self.stock,
+            "image": self.image
+        }
@@ -4,8 +4,10 @@ Represents the core vending machine class with state management
 Based on Mealy Machine architecture
 """
 
+from collections import Counter
+from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 
 class MachineState(Enum):
@@ -18,20 +20,74 @@ class MachineState(Enum):
     REFUND = "refund"
 
 
+@dataclass(frozen=True)
+class VMSnapshot:
+    """
+    Immutable copy of a machine's persistent fields
+    Stores publish whole snapshots and swap them atomically
+    """
+    __slots__ = ('version', 'state', 'balance_cents', 'selected_item', 'cart')
+    
+    version: int
+    state: str
+    balance_cents: int
+    selected_item: Optional[str]
+    cart: Tuple[Tuple[str, int], ...]  # (item_id, quantity) pairs
+
+
 class VendingMachine:
     """
     Main Vending Machine class
     Implements Mealy machine state management
     """
     
+    # Fixed attribute layout - no per-instance __dict__ (one machine per session)
+    __slots__ = ('current_state', 'balance', 'selected_item', 'cart', 'transaction_history',
+                 'version', '_cart_version', '_cart_view')
+    
     def __init__(self):
         """Initialize the vending machine in IDLE state"""
         self.current_state = MachineState.IDLE
-        self.balance = 0.0
+        self.balance = 0  # Integer cents
         self.selected_item = None
-        self.cart = []  # Shopping cart for multiple items
+        self.cart = Counter()  # Shopping cart: item_id -> quantity
         self.transaction_history = []
-        
+        self.version = 0  # Version of the stored state this machine was loaded from
+        self._cart_version = 0  # Bumped on every cart change
+        self._cart_view = None  # (cart version, flat tuple of item ids)
+    
+    @classmethod
+    def from_snapshot(cls, snapshot: VMSnapshot) -> "VendingMachine":
+        """Build a private, mutable working copy from a snapshot"""
+        vending_machine = cls()
+        vending_machine.current_state = MachineState(snapshot.state)
+        vending_machine.balance = snapshot.balance_cents
+        vending_machine.selected_item = snapshot.selected_item
+        vending_machine.set_cart_counts(dict(snapshot.cart))
+        vending_machine.version = snapshot.version
+        return vending_machine
+    
+    def to_snapshot(self, version: int) -> VMSnapshot:
+        """Freeze the current fields into a snapshot with the given version"""
+        return VMSnapshot(
+            version=version,
+            state=self.current_state.value,
+            balance_cents=self.balance,
+            selected_item=self.selected_item,
+            cart=tuple(self.cart.items())
+        )
+    
+    def snapshot(self) -> Dict:
+        """Current fields in response form, built in one pass"""
+        cart = self.cart_view()
+        return {
+            "state": self.current_state.value,
+            "balance": self.balance / 100,
+            "selected_item": self.selected_item,
+            "cart": cart,
+            "cart_count": len(cart)
+        }
+    
     def get_state(self) -> str:
         """Return the current state of the machine"""
         return self.current_state.value
@@ -41,24 +97,28 @@ class VendingMachine:
         self.current_state = new_state
     
     def get_balance(self) -> float:
-        """Return the current balance"""
+        """Return the current balance in dollars (for API responses)"""
+        return self.balance / 100
+    
+    def get_balance_cents(self) -> int:
+        """Return the current balance in cents"""
         return self.balance
     
-    def add_balance(self, amount: float) -> None:
-        """Add amount to the current balance"""
-        self.balance += amount
+    def add_balance(self, amount_cents: int) -> None:
+        """Add amount (in cents) to the current balance"""
+        self.balance += amount_cents
     
-    def deduct_balance(self, amount: float) -> bool:
-        """Deduct amount from balance if sufficient funds"""
-        if self.balance >= amount:
-            self.balance -= amount
+    def deduct_balance(self, amount_cents: int) -> bool:
+        """Deduct amount (in cents) from balance if sufficient funds"""
+        if self.balance >= amount_cents:
+            self.balance -= amount_cents
             return True
         return False
     
-    def clear_balance(self) -> float:
-        """Clear and return the current balance"""
+    def clear_balance(self) -> int:
+        """Clear and return the current balance in cents"""
         refund_amount = self.balance
-        self.balance = 0.0
+        self.balance = 0
         return refund_amount
     
     def set_selected_item(self, item_id: Optional[str]) -> None:
@@ -74,31 +134,62 @@ class VendingMachine:
         self.transaction_history.append(transaction)
     
     def get_transaction_history(self) -> list:
-        """Get all transaction history"""
+        """Get transactions recorded since the last save (the store clears this buffer)"""
         return self.transaction_history
     
     def reset(self) -> None:
         """Reset machine to IDLE state"""
         self.current_state = MachineState.IDLE
-        self.balance = 0.0
+        self.balance = 0
         self.selected_item = None
-        self.cart = []
+        self.clear_cart()
     
     def add_to_cart(self, item_id: str) -> None:
         """Add an item to the shopping cart"""
-        self.cart.append(item_id)
+        self.cart[item_id] += 1
+        self._cart_version += 1
     
     def remove_from_cart(self, item_id: str) -> bool:
-        """Remove an item from the cart"""
-        if item_id in self.cart:
-            self.cart.remove(item_id)
-            return True
-        return False
+        """Remove one unit of an item from the cart"""
+        if not self.cart[item_id]:
+            return False
+        self.cart[item_id] -= 1
+        if not self.cart[item_id]:
+            del self.cart[item_id]
+        self._cart_version += 1
+        return True
     
     def clear_cart(self) -> None:
         """Clear all items from cart"""
-        self.cart = []
+        self.set_cart_counts({})
+    
+    def set_cart_counts(self, counts: Dict[str, int]) -> None:
+        """Replace the cart with item_id -> quantity counts"""
+        self.cart = Counter(counts)
+        self._cart_version += 1
+    
+    def cart_view(self) -> Tuple[str, ...]:
+        """
+        Read-only flat tuple of the item ids in the cart (for API responses)
+        Built once and reused until the cart changes
+        """
+        view = self._cart_view
+        if view is None or view[0] != self._cart_version:
+            view = self._cart_view = (self._cart_version, tuple(self.cart.elements()))
+        return view[1]
+    
+    def copy_cart(self) -> list:
+        """Mutable copy of the cart as a flat list of item ids"""
+        return list(self.cart_view())
     
     def get_cart(self) -> list:
-        """Get current cart items"""
+        """Get current cart items as a flat list of item ids (a copy)"""
+        return self.copy_cart()
+    
+    def get_cart_counts(self) -> Counter:
+        """Get the cart as item_id -> quantity"""
         return self.cart
+    
+    def get_cart_count(self) -> int:
+        """Get the total number of items in the cart"""
+        return len(self.cart_view())
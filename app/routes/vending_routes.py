@@ -3,18 +3,144 @@ Vending Machine Routes
 Flask Blueprint for all vending machine API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from app.models.vending_machine import VendingMachine, MachineState
+import uuid
+from collections import Counter
+from functools import wraps
+import orjson
+from flask import Blueprint, Response, current_app, g, request, session
+from app.models.vending_machine import MachineState
 from app.services.state_manager import state_manager
-from app.services.payment import payment_service
+from app.services.payment import to_cents
 from app.services.inventory import inventory_service
+from app.services.session_store import ConcurrentUpdateError
 from app.services.transaction import transaction_service
 
 # Create Blueprint
 vending_bp = Blueprint('vending', __name__, url_prefix='/api')
 
-# Create a global vending machine instance (in production, use session management)
-vending_machine = VendingMachine()
+# Default and maximum number of transactions per /history page
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE = 500
+
+# Per-route state guard: endpoint -> (allowed states, rejection message)
+_ROUTE_ALLOWED_STATES = {
+    'select_item': (
+        frozenset({MachineState.COIN_INSERTED, MachineState.ITEM_SELECTED}),
+        "Insert coins before selecting an item"
+    ),
+    'purchase': (
+        frozenset({MachineState.ITEM_SELECTED}),
+        "No item ready for dispensing"
+    ),
+    'refund': (
+        frozenset({MachineState.COIN_INSERTED, MachineState.ITEM_SELECTED,
+                   MachineState.OUT_OF_STOCK}),
+        "No active transaction to refund"
+    ),
+}
+
+
+def _json(obj, status: int = 200) -> Response:
+    """Serialize a response body with orjson (faster than jsonify)"""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+def ok(data, status: int = 200, **extra) -> Response:
+    """
+    Success envelope {"success": true, "data": ..., **extra}
+    Written straight into bytes, without building the wrapper dict
+    """
+    return ok_raw(orjson.dumps(data), status, **extra)
+
+
+def ok_raw(data_json: bytes, status: int = 200, **extra) -> Response:
+    """Success envelope around a data payload that is already serialized"""
+    body = b'{"success":true,"data":' + data_json
+    if extra:
+        body += b',' + orjson.dumps(extra)[1:-1]
+    return Response(body + b'}', status=status, mimetype='application/json')
+
+
+def err(message: str, status: int = 400, **extra) -> Response:
+    """Failure envelope {"success": false, "message": ..., **extra}"""
+    return _json({"success": False, "message": message, **extra}, status)
+
+
+def _conflict() -> Response:
+    """Response for a request that lost an optimistic update race"""
+    return err("Machine was updated by another request, please retry", 409)
+
+
+def _store():
+    """Session store configured by create_app (in-memory or Redis)"""
+    return current_app.extensions['machine_store']
+
+
+def _session_id() -> str:
+    """Resolve the session id from the signed session cookie, issuing one if missing"""
+    session_id = session.get('sid')
+    if session_id is None:
+        session_id = session['sid'] = uuid.uuid4().hex
+    return session_id
+
+
+def _machine():
+    """
+    Load this session's vending machine once per request
+    Requests that may change it first take the machine's lock, held until teardown
+    """
+    if 'vending_machine' not in g:
+        session_id = _session_id()
+        if request.method != 'GET':
+            lock = transaction_service.machine_lock(session_id)
+            lock.acquire()
+            g.machine_lock = lock
+        g.vending_machine = _store().load(session_id)
+    return g.vending_machine
+
+
+def require_state(endpoint: str):
+    """
+    Decorator that loads the session's machine and rejects the request
+    with a 400 unless it is in one of the endpoint's allowed states
+    The machine is passed to the view as its first argument
+    """
+    allowed, message = _ROUTE_ALLOWED_STATES[endpoint]
+    
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            vending_machine = _machine()
+            if vending_machine.current_state not in allowed:
+                return err(message, 400,
+                           state=vending_machine.get_state(),
+                           cart=vending_machine.cart_view())
+            return view(vending_machine, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@vending_bp.after_request
+def save_machine(response):
+    """Persist the session's machine after any request that may have changed it"""
+    vending_machine = g.pop('vending_machine', None)
+    reserved_stock = g.pop('reserved_stock', None)
+    if vending_machine is not None and request.method != 'GET':
+        if not _store().save(_session_id(), vending_machine):
+            # The purchase is discarded with the machine, so give its stock back
+            if reserved_stock:
+                for item_id, quantity in reserved_stock.items():
+                    inventory_service.increase_stock(item_id, quantity)
+            return _conflict()
+    return response
+
+
+@vending_bp.teardown_request
+def release_machine(exc):
+    """Release the machine lock once the request (and its save) has finished"""
+    lock = g.pop('machine_lock', None)
+    if lock is not None:
+        lock.release()
 
 
 @vending_bp.route('/status', methods=['GET'])
@@ -22,12 +148,9 @@ def get_status():
     """
     Get current vending machine status
     Returns: current state, balance, selected item, available actions
+    Polls arriving while a session's status is being computed share that result
     """
-    status = transaction_service.get_transaction_status(vending_machine)
-    return jsonify({
-        "success": True,
-        "data": status
-    }), 200
+    return ok_raw(current_app.extensions['status_flight'].get(_session_id()))
 
 
 @vending_bp.route('/items', methods=['GET'])
@@ -35,12 +158,22 @@ def get_items():
     """
     Get all available items in the vending machine
     Returns: list of items with id, name, price, and stock
+    Supports conditional requests - 304 when If-None-Match matches the ETag
     """
-    items = inventory_service.get_all_items()
-    return jsonify({
-        "success": True,
-        "data": items
-    }), 200
+    payload, etag = inventory_service.get_all_items_response()
+    
+    # If-None-Match uses the weak comparison (RFC 7232), so W/"..." validators match too
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(payload, mimetype='application/json')
+    
+    # Shared caches may store the list, but stock changes after every purchase,
+    # so they must revalidate (cheap 304) rather than serve it blindly
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @vending_bp.route('/items/<item_id>', methods=['GET'])
@@ -52,15 +185,9 @@ def get_item(item_id):
     item = inventory_service.get_item(item_id)
     
     if not item:
-        return jsonify({
-            "success": False,
-            "message": "Item not found"
-        }), 404
+        return err("Item not found", 404)
     
-    return jsonify({
-        "success": True,
-        "data": item
-    }), 200
+    return ok(item.to_dict())
 
 
 @vending_bp.route('/insert-coin', methods=['POST'])
@@ -70,129 +197,76 @@ def insert_coin():
     Request body: { "amount": 1.0 }
     Returns: updated balance and state
     """
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=False)
     
     if not data or 'amount' not in data:
-        return jsonify({
-            "success": False,
-            "message": "Amount is required"
-        }), 400
+        return err("Amount is required", 400)
     
     try:
-        amount = float(data['amount'])
-    except (ValueError, TypeError):
-        return jsonify({
-            "success": False,
-            "message": "Invalid amount format"
-        }), 400
-    
-    # Check current state - must be IDLE, COIN_INSERTED, or ITEM_SELECTED (for adding more coins)
-    current_state = vending_machine.current_state
-    if current_state not in [MachineState.IDLE, MachineState.COIN_INSERTED, MachineState.ITEM_SELECTED]:
-        return jsonify({
-            "success": False,
-            "message": f"Cannot insert coin in {current_state.value} state",
-            "state": vending_machine.get_state()
-        }), 400
-    
-    # Transition state if in IDLE - MUST happen before inserting coin
-    if current_state == MachineState.IDLE:
-        success, message, new_state = state_manager.transition(vending_machine, "insert_coin")
-        if not success:
-            return jsonify({
-                "success": False,
-                "message": message,
-                "state": vending_machine.get_state()
-            }), 400
-    # If in ITEM_SELECTED state, we stay in that state (items already in cart)
-    # No state transition needed for COIN_INSERTED or ITEM_SELECTED
-    
-    # Insert coin
-    result = payment_service.insert_coin(vending_machine, amount)
-    
-    # Add state information
-    result['state'] = vending_machine.get_state()
-    result['cart'] = vending_machine.get_cart()
+        amount_cents = to_cents(data['amount'])
+    except (ValueError, TypeError, OverflowError):
+        return err("Invalid amount format", 400)
+    
+    # Coins for the same session are collapsed into one batched update
+    # No timeout: a coin is either credited and reported, or not applied at all
+    future = current_app.extensions['coin_collapser'].submit(_session_id(), amount_cents)
+    try:
+        result = future.result()
+    except ConcurrentUpdateError:
+        return _conflict()
     
     status_code = 200 if result['success'] else 400
-    return jsonify(result), status_code
+    return _json(result, status_code)
 
 
 @vending_bp.route('/select-item', methods=['POST'])
-def select_item():
+@require_state('select_item')
+def select_item(vending_machine):
     """
     Select an item to purchase (add to cart)
     Request body: { "item_id": "A1" }
     Returns: transaction status
     """
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=False)
     
     if not data or 'item_id' not in data:
-        return jsonify({
-            "success": False,
-            "message": "item_id is required"
-        }), 400
-    
-    item_id = data['item_id']
-    
-    # Check if we're in the right state (must have coins inserted)
-    if vending_machine.current_state not in [MachineState.COIN_INSERTED, MachineState.ITEM_SELECTED]:
-        return jsonify({
-            "success": False,
-            "message": "Insert coins before selecting an item",
-            "state": vending_machine.get_state(),
-            "cart": vending_machine.get_cart()
-        }), 400
+        return err("item_id is required", 400)
     
     # Add item to cart
-    result = transaction_service.initiate_purchase(vending_machine, item_id)
+    result = transaction_service.initiate_purchase(vending_machine, data['item_id'])
     
     status_code = 200 if result['success'] else 400
-    return jsonify(result), status_code
+    return _json(result, status_code)
 
 
 @vending_bp.route('/purchase', methods=['POST'])
-def purchase():
+@require_state('purchase')
+def purchase(vending_machine):
     """
     Complete the purchase and dispense item
     Returns: transaction details and change
     """
-    # Check if we're in the right state
-    if vending_machine.current_state != MachineState.ITEM_SELECTED:
-        return jsonify({
-            "success": False,
-            "message": "No item ready for dispensing",
-            "state": vending_machine.get_state()
-        }), 400
-    
-    # Complete purchase
     result = transaction_service.complete_purchase(vending_machine)
     
+    # Stock is already taken; remember it in case the session save loses its race
+    if result['success']:
+        g.reserved_stock = Counter(line["id"] for line in result['transaction']['items'])
+    
     status_code = 200 if result['success'] else 400
-    return jsonify(result), status_code
+    return _json(result, status_code)
 
 
 @vending_bp.route('/refund', methods=['POST'])
-def refund():
+@require_state('refund')
+def refund(vending_machine):
     """
     Cancel transaction and refund all money
     Returns: refunded amount
     """
-    # Check if refund is possible
-    if vending_machine.current_state not in [MachineState.COIN_INSERTED, 
-                                              MachineState.ITEM_SELECTED, 
-                                              MachineState.OUT_OF_STOCK]:
-        return jsonify({
-            "success": False,
-            "message": "No active transaction to refund",
-            "state": vending_machine.get_state()
-        }), 400
-    
-    # Process refund
     result = transaction_service.cancel_transaction(vending_machine)
     
     status_code = 200 if result['success'] else 400
-    return jsonify(result), status_code
+    return _json(result, status_code)
 
 
 @vending_bp.route('/reset', methods=['POST'])
@@ -201,26 +275,30 @@ def reset():
     Reset the vending machine to IDLE state
     Admin function for testing
     """
+    vending_machine = _machine()
     vending_machine.reset()
     state_manager.reset_to_idle(vending_machine)
     
-    return jsonify({
+    return _json({
         "success": True,
         "message": "Vending machine reset to IDLE state",
         "state": vending_machine.get_state()
-    }), 200
+    }, 200)
 
 
 @vending_bp.route('/history', methods=['GET'])
 def get_history():
     """
-    Get transaction history
-    Returns: list of all completed transactions
+    Get transaction history, newest first
+    Query params: after / before (timestamp_ns cursors - only entries newer than after
+    and strictly older than before), limit (default 50, max 500)
+    Pass the oldest timestamp_ns of a page as before to fetch the next (older) page
+    Returns: one page of completed transactions
     """
-    history = vending_machine.get_transaction_history()
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    limit = max(0, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), HISTORY_MAX_PAGE))
+    page = _store().get_history_page(_session_id(), after, before, limit)
+    history = [transaction_service.render_transaction(transaction) for transaction in page]
     
-    return jsonify({
-        "success": True,
-        "data": history,
-        "count": len(history)
-    }), 200
+    return ok(history, count=len(history))
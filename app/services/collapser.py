@@ -0,0 +1,119 @@
+"""
+Request Collapser Service
+Collapses operations arriving for the same key while an earlier one is
+still being applied, and applies them as one batch on the first caller's thread
+SingleFlight shares one in-progress read between concurrent callers
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class Collapser:
+    """
+    Batches submitted items per key
+    The first submitter for a key leads. If no batch for the key is being
+    applied it closes its batch at once; otherwise it keeps collecting until
+    that batch finishes (or max_queue items are waiting). It then applies the
+    batch on its own (request) thread and resolves every future, so a lone
+    caller never waits and batches for different keys never wait on each other
+    apply_batch(key, items) must return one result per item, in order
+    """
+
+    def __init__(self, apply_batch: Callable[[str, List[Any]], List[Any]],
+                 max_queue: int = 32):
+        """
+        Initialize collapser
+        max_queue: apply a batch as soon as it has this many items
+        """
+        self.apply_batch = apply_batch
+        self.max_queue = max_queue
+        self._batches: Dict[str, List[Tuple[Any, Future]]] = {}
+        self._applying: Dict[str, int] = {}
+        self._condition = threading.Condition()
+
+    def submit(self, key: str, item: Any) -> Future:
+        """
+        Add an item to key's open batch and return a Future for its result
+        The leader's Future is already resolved on return; the others are
+        resolved by the leader, which is always a live request thread
+        """
+        future = Future()
+
+        with self._condition:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = []
+            batch.append((item, future))
+
+            if leader:
+                # Followers append while the previous batch for this key is applied
+                self._condition.wait_for(
+                    lambda: not self._applying.get(key) or len(batch) >= self.max_queue)
+                # Close the batch - anything submitted from now on starts a new one
+                del self._batches[key]
+                self._applying[key] = self._applying.get(key, 0) + 1
+            elif len(batch) >= self.max_queue:
+                self._condition.notify_all()
+
+        if leader:
+            try:
+                self._apply(key, batch)
+            finally:
+                with self._condition:
+                    self._applying[key] -= 1
+                    if not self._applying[key]:
+                        del self._applying[key]
+                    self._condition.notify_all()
+        return future
+
+    def _apply(self, key: str, entries: List[Tuple[Any, Future]]) -> None:
+        """Apply one closed batch and resolve its futures"""
+        try:
+            results = self.apply_batch(key, [item for item, _ in entries])
+        except Exception as exc:
+            for _, future in entries:
+                future.set_exception(exc)
+        else:
+            for (_, future), result in zip(entries, results):
+                future.set_result(result)
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent reads per key
+    The first caller for a key computes at once on its own thread; callers
+    arriving while that computation runs wait for it and share its result
+    compute(key) is called again as soon as the previous call has finished
+    """
+
+    def __init__(self, compute: Callable[[str], Any]):
+        """Initialize with the read to share"""
+        self.compute = compute
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """Return compute(key), joining a call already in progress for key"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = self.compute(key)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
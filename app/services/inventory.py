@@ -3,126 +3,167 @@ Inventory Management Service
 Handles item list, pricing, and stock management
 """
 
-from typing import Dict, List, Optional
+import hashlib
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import orjson
+from app.models.item import Item
+
+# Default catalog - edit this file to change items, prices or starting stock
+INVENTORY_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'inventory.json')
 
 
 class InventoryService:
     """Manages vending machine inventory"""
     
-    def __init__(self):
-        """Initialize inventory with default items"""
-        self.items = {
-            "A1": {
-                "id": "A1",
-                "name": "Coca Cola",
-                "price": 1.50,
-                "stock": 10,
-                "image": "https://images.unsplash.com/photo-1554866585-cd94860890b7?w=200&h=200&fit=crop"
-            },
-            "A2": {
-                "id": "A2",
-                "name": "Pepsi",
-                "price": 1.50,
-                "stock": 8,
-                "image": "https://images.unsplash.com/photo-1629203851122-3726ecdf080e?w=200&h=200&fit=crop"
-            },
-            "A3": {
-                "id": "A3",
-                "name": "Water",
-                "price": 1.00,
-                "stock": 15,
-                "image": "https://images.unsplash.com/photo-1548839140-29a749e1cf4d?w=200&h=200&fit=crop"
-            },
-            "B1": {
-                "id": "B1",
-                "name": "Chips",
-                "price": 2.00,
-                "stock": 12,
-                "image": "https://images.unsplash.com/photo-1566478989037-eec170784d0b?w=200&h=200&fit=crop"
-            },
-            "B2": {
-                "id": "B2",
-                "name": "Chocolate",
-                "price": 2.50,
-                "stock": 7,
-                "image": "https://images.unsplash.com/photo-1511381939415-e44015466834?w=200&h=200&fit=crop"
-            },
-            "B3": {
-                "id": "B3",
-                "name": "Candy",
-                "price": 1.75,
-                "stock": 20,
-                "image": "https://images.unsplash.com/photo-1582058091505-f87a2e55a40f?w=200&h=200&fit=crop"
-            },
-            "C1": {
-                "id": "C1",
-                "name": "Cookie",
-                "price": 2.25,
-                "stock": 5,
-                "image": "https://images.unsplash.com/photo-1499636136210-6f4ee915583e?w=200&h=200&fit=crop"
-            },
-            "C2": {
-                "id": "C2",
-                "name": "Juice",
-                "price": 2.00,
-                "stock": 4,
-                "image": "https://images.unsplash.com/photo-1600271886742-f049cd451bba?w=200&h=200&fit=crop"
-            },
-            "C3": {
-                "id": "C3",
-                "name": "Energy Drink",
-                "price": 3.00,
-                "stock": 6,
-                "image": "https://images.unsplash.com/photo-1622543925917-763c34d1a86e?w=200&h=200&fit=crop"
+    def __init__(self, inventory_file: str = INVENTORY_FILE):
+        """Initialize inventory from the JSON catalog file"""
+        with open(inventory_file, 'rb') as f:
+            self.items: Dict[str, Item] = {
+                spec["id"]: Item.from_spec(spec) for spec in orjson.loads(f.read())
             }
+        
+        # Per-item transaction line {"id", "name", "price"}, shared by every purchase
+        # A price change replaces the entry, so recorded transactions keep their price
+        self._line_items: Dict[str, Dict] = {
+            item_id: self._line_item(item) for item_id, item in self.items.items()
         }
+        
+        # Stock is shared by every session, so each check-and-decrement runs under this lock
+        self._lock = threading.Lock()
+        
+        # Catalog mutation counter: bumped by every stock or price change
+        # Anything cached from the catalog stays valid while it is unchanged
+        self._catalog_version = 0
+        
+        # Serialized /items response and its ETag, tagged with the catalog version
+        # Built eagerly so the first /items request is already a cache hit
+        self._cached_response: Optional[Tuple[int, bytes, str]] = None
+        self.get_all_items_response()
+    
+    @staticmethod
+    def _line_item(item: Item) -> Dict:
+        """Build the transaction line record for an item"""
+        return {"id": item.id, "name": item.name, "price": item.price}
+    
+    def _touch(self) -> None:
+        """Record a catalog change, invalidating caches built from it"""
+        self._catalog_version += 1
     
     def get_all_items(self) -> List[Dict]:
-        """Return all items in inventory"""
-        return list(self.items.values())
+        """Return all items in inventory as plain dicts"""
+        return [item.to_dict() for item in self.items.values()]
+    
+    def get_all_items_response(self) -> Tuple[bytes, str]:
+        """
+        Return the serialized /items response body and its ETag
+        Both are computed lazily and reused until stock or price changes
+        """
+        cached = self._cached_response
+        version = self._catalog_version
+        if cached is None or cached[0] != version:
+            # A mutation racing this build bumps the version, so the stale result
+            # is never served again
+            payload = orjson.dumps({"success": True, "data": self.get_all_items()})
+            cached = (version, payload, hashlib.blake2b(payload, digest_size=8).hexdigest())
+            self._cached_response = cached
+        return cached[1], cached[2]
     
-    def get_item(self, item_id: str) -> Optional[Dict]:
+    def get_item(self, item_id: str) -> Optional[Item]:
         """Get a specific item by ID"""
         return self.items.get(item_id)
     
+    def get_available(self, item_id: str) -> Tuple[Optional[Item], bool]:
+        """Look up an item and whether it is in stock with a single dict probe"""
+        item = self.items.get(item_id)
+        return item, item is not None and item.stock > 0
+    
     def is_item_available(self, item_id: str) -> bool:
         """Check if item exists and is in stock"""
-        item = self.get_item(item_id)
-        if item and item["stock"] > 0:
-            return True
-        return False
+        return self.get_available(item_id)[1]
+    
+    def total_price_cents(self, cart_counts: Dict[str, int]) -> int:
+        """Total price in cents of a cart given as item_id -> quantity (unknown ids are skipped)"""
+        items = self.items
+        return sum(items[item_id].price_cents * qty for item_id, qty in cart_counts.items() if item_id in items)
+    
+    def get_items(self, item_ids: Iterable[str]) -> Dict[str, Item]:
+        """Look up several items at once; unknown ids are left out"""
+        items = self.items
+        return {item_id: items[item_id] for item_id in item_ids if item_id in items}
+    
+    def get_line_items(self, item_ids: Iterable[str]) -> List[Dict]:
+        """Transaction lines for known item ids, one per occurrence (shared records)"""
+        line_items = self._line_items
+        return [line_items[item_id] for item_id in item_ids if item_id in line_items]
+    
+    def are_items_available(self, item_ids: Iterable[str]) -> Dict[str, bool]:
+        """Stock check for several items; unknown ids are left out"""
+        items = self.items
+        return {item_id: items[item_id].stock > 0 for item_id in item_ids if item_id in items}
     
     def get_item_price(self, item_id: str) -> Optional[float]:
-        """Get the price of an item"""
+        """Get the price of an item in dollars"""
         item = self.get_item(item_id)
-        return item["price"] if item else None
+        return item.price if item else None
+    
+    def get_item_price_cents(self, item_id: str) -> Optional[int]:
+        """Get the price of an item in cents"""
+        item = self.get_item(item_id)
+        return item.price_cents if item else None
     
     def get_item_stock(self, item_id: str) -> Optional[int]:
         """Get the stock count of an item"""
         item = self.get_item(item_id)
-        return item["stock"] if item else None
+        return item.stock if item else None
     
-    def decrease_stock(self, item_id: str) -> bool:
-        """Decrease stock by 1 for a given item"""
+    def decrease_stock(self, item_id: str, quantity: int = 1) -> bool:
+        """Decrease stock of a given item by quantity if enough is left"""
         item = self.get_item(item_id)
-        if item and item["stock"] > 0:
-            item["stock"] -= 1
-            return True
+        with self._lock:
+            if item and item.stock >= quantity:
+                item.stock -= quantity
+                self._touch()
+                return True
         return False
     
+    def decrease_stock_bulk(self, quantities: Dict[str, int]) -> bool:
+        """
+        Decrease stock for several items (item_id -> quantity) in one pass
+        All-or-nothing: nothing changes unless every item has enough stock
+        The stock is re-read under the lock, so concurrent buyers cannot oversell
+        """
+        items = self.get_items(quantities)
+        if len(items) != len(quantities):
+            return False
+        
+        with self._lock:
+            if any(items[item_id].stock < qty for item_id, qty in quantities.items()):
+                return False
+            for item_id, qty in quantities.items():
+                items[item_id].stock -= qty
+            self._touch()
+        return True
+    
     def increase_stock(self, item_id: str, quantity: int = 1) -> bool:
         """Increase stock for a given item"""
         item = self.get_item(item_id)
         if item:
-            item["stock"] += quantity
+            with self._lock:
+                item.stock += quantity
+                self._touch()
             return True
         return False
     
     def update_item_price(self, item_id: str, new_price: float) -> bool:
-        """Update the price of an item"""
+        """Update the price of an item (given in dollars)"""
         item = self.get_item(item_id)
         if item:
-            item["price"] = new_price
+            with self._lock:
+                item.price_cents = round(new_price * 100)
+                self._line_items[item_id] = self._line_item(item)
+                self._touch()
             return True
         return False
 
@@ -6,26 +6,48 @@ Handles coin insertion, balance management, and refunds
 from typing import Dict
 
 
+def to_cents(amount: float) -> int:
+    """Convert a dollar amount to integer cents"""
+    return round(float(amount) * 100)
+
+
+def to_dollars(cents: int) -> float:
+    """Convert integer cents to dollars (JSON boundary only)"""
+    return cents / 100
+
+
+def format_cents(cents: int) -> str:
+    """Format integer cents as a dollar string, e.g. 150 -> "$1.50" (no float math)"""
+    dollars, cents = divmod(cents, 100)
+    return f"${dollars}.{cents:02d}"
+
+
 class PaymentService:
-    """Manages payment operations for the vending machine"""
+    """
+    Manages payment operations for the vending machine
+    All amounts are integer cents internally
+    """
+    
+    # Accepted coin denominations (in cents)
+    ACCEPTED_COINS_CENTS = frozenset({25, 50, 100, 200})
     
-    # Accepted coin denominations
-    ACCEPTED_COINS = [0.25, 0.50, 1.00, 2.00]
+    # Accepted coin denominations in dollars, for messages
+    ACCEPTED_COINS = [to_dollars(cents) for cents in sorted(ACCEPTED_COINS_CENTS)]
     
     def __init__(self):
         """Initialize payment service"""
         pass
     
-    def is_valid_coin(self, amount: float) -> bool:
-        """Check if the coin amount is valid"""
-        return amount in self.ACCEPTED_COINS
+    def is_valid_coin(self, amount_cents: int) -> bool:
+        """Check if the coin amount (in cents) is valid"""
+        return amount_cents in self.ACCEPTED_COINS_CENTS
     
-    def insert_coin(self, vending_machine, amount: float) -> Dict:
+    def insert_coin(self, vending_machine, amount_cents: int) -> Dict:
         """
         Insert a coin into the vending machine
         Returns: success status and message
         """
-        if not self.is_valid_coin(amount):
+        if not self.is_valid_coin(amount_cents):
             return {
                 "success": False,
                 "message": f"Invalid coin. Accepted: {self.ACCEPTED_COINS}",
@@ -33,24 +55,24 @@ class PaymentService:
             }
         
         # Add amount to balance
-        vending_machine.add_balance(amount)
+        vending_machine.add_balance(amount_cents)
         
         return {
             "success": True,
-            "message": f"${amount:.2f} inserted successfully",
+            "message": f"{format_cents(amount_cents)} inserted successfully",
             "balance": vending_machine.get_balance()
         }
     
-    def check_sufficient_balance(self, vending_machine, required_amount: float) -> bool:
+    def check_sufficient_balance(self, vending_machine, required_cents: int) -> bool:
         """Check if current balance is sufficient for purchase"""
-        return vending_machine.get_balance() >= required_amount
+        return vending_machine.get_balance_cents() >= required_cents
     
-    def process_payment(self, vending_machine, amount: float) -> Dict:
+    def process_payment(self, vending_machine, amount_cents: int) -> Dict:
         """
         Process payment by deducting from balance
         Returns: success status and remaining balance
         """
-        if vending_machine.deduct_balance(amount):
+        if vending_machine.deduct_balance(amount_cents):
             return {
                 "success": True,
                 "message": "Payment processed successfully",
@@ -68,18 +90,18 @@ class PaymentService:
         Process refund and return all balance
         Returns: refunded amount
         """
-        refund_amount = vending_machine.clear_balance()
+        refund_cents = vending_machine.clear_balance()
         
         return {
             "success": True,
-            "message": f"Refunded ${refund_amount:.2f}",
-            "refund_amount": refund_amount,
+            "message": f"Refunded {format_cents(refund_cents)}",
+            "refund_amount": to_dollars(refund_cents),
             "balance": 0.0
         }
     
-    def calculate_change(self, balance: float, item_price: float) -> float:
-        """Calculate change after purchase"""
-        return balance - item_price
+    def calculate_change(self, balance_cents: int, price_cents: int) -> int:
+        """Calculate change (in cents) after purchase"""
+        return balance_cents - price_cents
 
 
 # Create a singleton instance
@@ -0,0 +1,256 @@
+"""
+Session Store Service
+Keeps one vending machine state per browser session
+Uses Redis when configured so state is shared across Gunicorn workers
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import redis
+from app.models.vending_machine import VendingMachine, MachineState, VMSnapshot
+
+
+class ConcurrentUpdateError(Exception):
+    """Raised when another request saved the same session first"""
+    pass
+
+
+# Every session starts from this IDLE snapshot
+_EMPTY_SNAPSHOT = VendingMachine().to_snapshot(version=0)
+
+# Maximum number of transactions kept per session
+HISTORY_LIMIT = 10000
+
+# Idle sessions expire after one day (seconds since their last save)
+SESSION_TTL = 24 * 60 * 60
+
+
+def _page(entries_newest_first, after: Optional[int], before: Optional[int],
+          limit: int) -> List[Dict]:
+    """
+    Take up to limit entries strictly between the after and before cursors (ns)
+    Entries not older than the last one taken are skipped, so the page is
+    strictly newest first even if the source shifts while it is read
+    """
+    page = []
+    for entry in entries_newest_first:
+        if len(page) >= limit:
+            break
+        timestamp_ns = entry.get("timestamp_ns", 0)
+        if before is not None and timestamp_ns >= before:
+            continue
+        if after is not None and timestamp_ns <= after:
+            break
+        page.append(entry)
+        before = timestamp_ns
+    return page
+
+
+def _count_older(entries_oldest_first: List[Dict], before: int) -> int:
+    """Number of leading entries older than before (ns); timestamps only increase"""
+    low, high = 0, len(entries_oldest_first)
+    while low < high:
+        mid = (low + high) // 2
+        if entries_oldest_first[mid].get("timestamp_ns", 0) < before:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+class MemoryMachineStore:
+    """
+    In-process store used when no Redis server is configured
+    Holds one immutable snapshot per session (development / single worker)
+    Each request works on a private copy and publishes it with a
+    compare-and-swap, so loads never take a lock
+    Like the Redis keys, a session expires SESSION_TTL after its last save
+    """
+
+    def __init__(self):
+        """Initialize empty session -> snapshot and session -> history mappings"""
+        self.snapshots: Dict[str, VMSnapshot] = {}
+        # Oldest first; appended and paged under _history_lock
+        self.histories: Dict[str, List[Dict]] = {}
+        # session -> expiry (monotonic seconds), oldest first since every save moves it to the end
+        self._deadlines: "OrderedDict[str, float]" = OrderedDict()
+        self._swap_lock = threading.Lock()
+        self._history_lock = threading.Lock()
+
+    def _live(self, session_id: str) -> bool:
+        """Whether the session was saved within SESSION_TTL"""
+        return self._deadlines.get(session_id, 0.0) > time.monotonic()
+
+    def _purge_expired(self, now: float) -> None:
+        """Drop sessions whose deadline has passed (caller holds _swap_lock)"""
+        while self._deadlines:
+            session_id, deadline = next(iter(self._deadlines.items()))
+            if deadline > now:
+                return
+            del self._deadlines[session_id]
+            self.snapshots.pop(session_id, None)
+            self.histories.pop(session_id, None)
+
+    def load(self, session_id: str) -> VendingMachine:
+        """Return a working copy of the session's machine"""
+        snapshot = self.snapshots.get(session_id, _EMPTY_SNAPSHOT) if self._live(session_id) else _EMPTY_SNAPSHOT
+        return VendingMachine.from_snapshot(snapshot)
+
+    def _cas_swap(self, session_id: str, expected_version: int, snapshot: VMSnapshot) -> bool:
+        """Publish snapshot only if the stored version is still expected_version"""
+        now = time.monotonic()
+        with self._swap_lock:
+            self._purge_expired(now)
+            if self.snapshots.get(session_id, _EMPTY_SNAPSHOT).version != expected_version:
+                return False
+            self.snapshots[session_id] = snapshot
+            self._deadlines[session_id] = now + SESSION_TTL
+            self._deadlines.move_to_end(session_id)
+            return True
+
+    def save(self, session_id: str, vending_machine: VendingMachine) -> bool:
+        """
+        Publish the working copy and append its new transactions
+        Returns False if another request saved this session in the meantime
+        """
+        snapshot = vending_machine.to_snapshot(version=vending_machine.version + 1)
+        if not self._cas_swap(session_id, vending_machine.version, snapshot):
+            return False
+        vending_machine.version = snapshot.version
+
+        history = vending_machine.get_transaction_history()
+        if history:
+            with self._history_lock:
+                entries = self.histories.setdefault(session_id, [])
+                entries.extend(history)
+                if len(entries) > HISTORY_LIMIT:
+                    del entries[:len(entries) - HISTORY_LIMIT]
+            history.clear()
+        return True
+
+    def get_history_page(self, session_id: str, after: Optional[int], before: Optional[int],
+                         limit: int) -> List[Dict]:
+        """Get up to limit transactions between the after and before timestamps (ns), newest first"""
+        if limit <= 0 or not self._live(session_id):
+            return []
+        with self._history_lock:
+            entries = self.histories.get(session_id, [])
+            # Jump straight to the cursor, then walk back at most limit entries
+            start = len(entries) if before is None else _count_older(entries, before)
+            return _page((entries[i] for i in range(start - 1, -1, -1)), after, None, limit)
+
+
+class RedisMachineStore:
+    """
+    Redis-backed store
+    Layout per session id:
+        vm:{sid}       hash  - version, state, balance (cents), selected_item
+        vm:{sid}:cart  hash  - item id -> quantity in the cart
+        vm:{sid}:hist  list  - JSON transactions, newest first, capped
+    """
+
+    # Key expiry, shared with the in-process store
+    SESSION_TTL = SESSION_TTL
+    
+    # Entries read per LRANGE while skipping to a before cursor
+    HISTORY_CHUNK = 200
+
+    def __init__(self, redis_client):
+        """Initialize store with a redis.Redis(decode_responses=True) client"""
+        self.redis = redis_client
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        """Hash key holding the scalar machine fields"""
+        return f"vm:{session_id}"
+
+    def load(self, session_id: str) -> VendingMachine:
+        """Fetch machine fields and cart counts in a single round trip"""
+        key = self._key(session_id)
+        # MULTI/EXEC, so the fields and the cart always come from the same save
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hgetall(key)
+        pipe.hgetall(f"{key}:cart")
+        fields, cart = pipe.execute()
+
+        vending_machine = VendingMachine()
+        if fields:
+            vending_machine.version = int(fields["version"])
+            vending_machine.set_state(MachineState(fields["state"]))
+            vending_machine.balance = int(fields["balance"])
+            vending_machine.set_selected_item(fields.get("selected_item") or None)
+        vending_machine.set_cart_counts({item_id: int(qty) for item_id, qty in cart.items()})
+        return vending_machine
+
+    def save(self, session_id: str, vending_machine: VendingMachine) -> bool:
+        """
+        Write back machine fields, cart and new transactions atomically
+        Optimistic: WATCH the hash and only commit if its version is unchanged
+        Returns False if another request saved this session in the meantime
+        """
+        key = self._key(session_id)
+        cart_key = f"{key}:cart"
+        hist_key = f"{key}:hist"
+
+        with self.redis.pipeline(transaction=True) as pipe:
+            try:
+                pipe.watch(key)
+                if int(pipe.hget(key, "version") or 0) != vending_machine.version:
+                    return False
+
+                pipe.multi()
+                pipe.hset(key, mapping={
+                    "version": vending_machine.version + 1,
+                    "state": vending_machine.get_state(),
+                    "balance": vending_machine.get_balance_cents(),
+                    "selected_item": vending_machine.get_selected_item() or "",
+                })
+                pipe.delete(cart_key)
+                if vending_machine.cart:
+                    pipe.hset(cart_key, mapping=dict(vending_machine.get_cart_counts()))
+
+                history = vending_machine.get_transaction_history()
+                if history:
+                    pipe.lpush(hist_key, *(json.dumps(transaction) for transaction in history))
+                    pipe.ltrim(hist_key, 0, HISTORY_LIMIT - 1)
+
+                # Every save keeps the whole session alive, history included
+                pipe.expire(key, self.SESSION_TTL)
+                pipe.expire(cart_key, self.SESSION_TTL)
+                pipe.expire(hist_key, self.SESSION_TTL)
+                pipe.execute()
+            except redis.WatchError:
+                return False
+
+        vending_machine.version += 1
+        vending_machine.get_transaction_history().clear()
+        return True
+
+    def _iter_history(self, hist_key: str, chunk: int):
+        """Yield stored transactions newest first, reading chunk entries per round trip"""
+        start = 0
+        while True:
+            entries = self.redis.lrange(hist_key, start, start + chunk - 1)
+            yield from map(json.loads, entries)
+            if len(entries) < chunk:
+                return
+            start += chunk
+    
+    def get_history_page(self, session_id: str, after: Optional[int], before: Optional[int],
+                         limit: int) -> List[Dict]:
+        """Get up to limit transactions between the after and before timestamps (ns), newest first"""
+        if limit <= 0:
+            return []
+        # Without a before cursor the first chunk already holds the whole page
+        chunk = limit if before is None else max(limit, self.HISTORY_CHUNK)
+        return _page(self._iter_history(f"{self._key(session_id)}:hist", chunk), after, before, limit)
+
+
+def create_machine_store(redis_client=None):
+    """Pick the Redis store when a client is configured, else keep state in memory"""
+    if redis_client is not None:
+        return RedisMachineStore(redis_client)
+    return MemoryMachineStore()
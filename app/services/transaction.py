@@ -4,64 +4,153 @@ Handles purchase, cancel, and refund logic
 Coordinates between state manager, payment, and inventory services
 """
 
+import threading
+import time
+import weakref
+from collections import Counter
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
+import orjson
 from app.models.vending_machine import MachineState
 from app.services.state_manager import state_manager
-from app.services.payment import payment_service
+from app.services.payment import payment_service, format_cents, to_dollars
 from app.services.inventory import inventory_service
+from app.services.session_store import ConcurrentUpdateError
+
+
+def _format_ts(timestamp_ns: int) -> str:
+    """Render a nanosecond timestamp as local ISO 8601 (only when sent to a client)"""
+    return datetime.fromtimestamp(timestamp_ns / 1_000_000_000).isoformat()
+
+
+# States in which a coin may be inserted
+_COIN_ALLOWED = frozenset({MachineState.IDLE, MachineState.COIN_INSERTED, MachineState.ITEM_SELECTED})
 
 
 class TransactionService:
     """Manages complete transaction workflows"""
     
+    # Bound once here rather than looked up through the module on every call
+    _transition = state_manager.transition
+    
     def __init__(self):
         """Initialize transaction service"""
-        pass
+        # One re-entrant lock per machine (session id), so different machines never
+        # serialize against each other; the guard makes lock creation atomic.
+        # Entries are weak, so a session's lock goes away once no request holds it
+        self._locks = weakref.WeakValueDictionary()
+        self._locks_guard = threading.Lock()
+    
+    def machine_lock(self, session_id: str):
+        """
+        Lock covering one machine's load -> mutate -> save within this process
+        Keeps concurrent requests for the same machine from redoing checks and
+        stock changes that would then be lost in a save conflict
+        """
+        with self._locks_guard:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = threading.RLock()
+            return lock
+    
+    def insert_coin(self, vending_machine, amount_cents: int) -> Dict:
+        """
+        Insert a coin (in cents) into the vending machine
+        Returns: updated balance, state and cart
+        """
+        # Check current state - must be IDLE, COIN_INSERTED, or ITEM_SELECTED (for adding more coins)
+        current_state = vending_machine.current_state
+        if current_state not in _COIN_ALLOWED:
+            return {
+                "success": False,
+                "message": f"Cannot insert coin in {current_state.value} state",
+                "state": vending_machine.get_state()
+            }
+        
+        # Transition state if in IDLE - MUST happen before inserting coin
+        if current_state == MachineState.IDLE:
+            success, message, new_state = self._transition(vending_machine, "insert_coin")
+            if not success:
+                return {
+                    "success": False,
+                    "message": message,
+                    "state": vending_machine.get_state()
+                }
+        # If in ITEM_SELECTED state, we stay in that state (items already in cart)
+        # No state transition needed for COIN_INSERTED or ITEM_SELECTED
+        
+        # Insert coin
+        result = payment_service.insert_coin(vending_machine, amount_cents)
+        
+        # Add state information
+        result['state'] = vending_machine.get_state()
+        result['cart'] = vending_machine.cart_view()
+        
+        return result
+    
+    def apply_coin_batch(self, machine_store, session_id: str, amounts_cents: List[int]) -> List[Dict]:
+        """
+        Insert several coins for one session with a single load/save
+        Used by the insert-coin collapser; returns one result per coin
+        """
+        with self.machine_lock(session_id):
+            vending_machine = machine_store.load(session_id)
+            results = [self.insert_coin(vending_machine, amount_cents) for amount_cents in amounts_cents]
+            if not machine_store.save(session_id, vending_machine):
+                raise ConcurrentUpdateError(session_id)
+        return results
+    
+    def status_json(self, machine_store, session_id: str) -> bytes:
+        """
+        Load a session's machine and serialize its status
+        Used by the /status single-flight, so concurrent polls share the bytes
+        """
+        return orjson.dumps(self.get_transaction_status(machine_store.load(session_id)))
     
     def initiate_purchase(self, vending_machine, item_id: str) -> Dict:
         """
         Add item to cart (for multi-item purchases)
         """
         # Check current state - must have coins inserted
+        # Error responses only carry the state, so build just that (not a full snapshot)
+        state = vending_machine.get_state()
         if vending_machine.current_state == MachineState.IDLE:
             return {
                 "success": False,
                 "message": "Please insert coins first",
-                "state": vending_machine.get_state()
+                "state": state
             }
         
-        # Check if item exists
-        item = inventory_service.get_item(item_id)
+        # Check if item exists and is in stock (one lookup)
+        item, available = inventory_service.get_available(item_id)
         if not item:
             return {
                 "success": False,
                 "message": "Item not found",
-                "state": vending_machine.get_state()
+                "state": state
             }
         
-        # Check if item is in stock
-        if not inventory_service.is_item_available(item_id):
+        if not available:
             return {
                 "success": False,
-                "message": f"{item['name']} is out of stock",
-                "state": vending_machine.get_state(),
-                "item": item
+                "message": f"{item.name} is out of stock",
+                "state": state,
+                "item": item.to_dict()
             }
         
         # Add to cart
         vending_machine.add_to_cart(item_id)
         
-        # Transition to ITEM_SELECTED state if we're in COIN_INSERTED
-        if vending_machine.current_state == MachineState.COIN_INSERTED:
-            state_manager.transition(vending_machine, "select_item")
+        # Move to (or stay in) ITEM_SELECTED - a table self-loop, so no state check is needed
+        self._transition(vending_machine, "select_item")
         
+        snap = vending_machine.snapshot()
         return {
             "success": True,
-            "message": f"{item['name']} added to cart",
-            "state": vending_machine.get_state(),
-            "cart": vending_machine.get_cart(),
-            "item": item
+            "message": f"{item.name} added to cart",
+            "state": snap["state"],
+            "cart": snap["cart"],
+            "item": item.to_dict()
         }
     
     def complete_purchase(self, vending_machine) -> Dict:
@@ -69,50 +158,69 @@ class TransactionService:
         Complete the purchase transaction for all items in cart
         """
         # Verify we have items in cart
-        cart = vending_machine.get_cart()
-        if not cart:
+        snap = vending_machine.snapshot()
+        if not snap["cart_count"]:
             return {
                 "success": False,
                 "message": "Cart is empty",
-                "state": vending_machine.get_state()
+                "state": snap["state"]
             }
         
-        # Calculate total price
-        total_price = 0
-        items_to_purchase = []
-        
-        for item_id in cart:
-            item = inventory_service.get_item(item_id)
-            if not item:
-                continue
-            
-            # Check stock
-            if not inventory_service.is_item_available(item_id):
-                return {
-                    "success": False,
-                    "message": f"{item['name']} is out of stock",
-                    "state": vending_machine.get_state()
-                }
-            
-            total_price += item['price']
-            items_to_purchase.append(item)
+        # Fetch all cart items and their availability in one batched call each
+        cart_counts = vending_machine.get_cart_counts()
+        items_map = inventory_service.get_items(cart_counts)
+        available = inventory_service.are_items_available(items_map)
+        
+        # Work per unique id with its quantity - unknown ids are skipped and the
+        # first purchasable item without stock fails the cart
+        quantities = Counter({item_id: qty for item_id, qty in cart_counts.items() if item_id in items_map})
+        sold_out = next((items_map[item_id] for item_id in quantities if not available[item_id]), None)
+        if sold_out is not None:
+            return {
+                "success": False,
+                "message": f"{sold_out.name} is out of stock",
+                "state": snap["state"]
+            }
+        
+        # Calculate total price (in cents)
+        total_cents = inventory_service.total_price_cents(cart_counts)
+        total_price = to_dollars(total_cents)
         
         # Check if balance is sufficient
-        if not payment_service.check_sufficient_balance(vending_machine, total_price):
+        if not payment_service.check_sufficient_balance(vending_machine, total_cents):
             return {
                 "success": False,
-                "message": f"Insufficient balance. Need ${total_price:.2f}, have ${vending_machine.get_balance():.2f}",
-                "state": vending_machine.get_state(),
-                "balance": vending_machine.get_balance()
+                "message": f"Insufficient balance. Need {format_cents(total_cents)}, "
+                           f"have {format_cents(vending_machine.get_balance_cents())}",
+                "state": snap["state"],
+                "balance": snap["balance"]
+            }
+        
+        # Take the stock now - the check is repeated under the inventory lock, so an
+        # item sold to another session since the pre-check fails here, before any
+        # state change or payment
+        if not inventory_service.decrease_stock_bulk(quantities):
+            sold_out = next(
+                (items_map[item_id] for item_id, qty in quantities.items()
+                 if inventory_service.get_item_stock(item_id) < qty),
+                items_map[next(iter(quantities))]
+            )
+            return {
+                "success": False,
+                "message": f"{sold_out.name} is out of stock",
+                "state": snap["state"]
             }
         
         # Transition to DISPENSING state
-        state_manager.transition(vending_machine, "dispense")
+        self._transition(vending_machine, "dispense")
         
         # Process payment
-        payment_result = payment_service.process_payment(vending_machine, total_price)
+        payment_result = payment_service.process_payment(vending_machine, total_cents)
         
         if not payment_result["success"]:
+            # Put the reserved stock back
+            for item_id, qty in quantities.items():
+                inventory_service.increase_stock(item_id, qty)
             state_manager.reset_to_idle(vending_machine)
             return {
                 "success": False,
@@ -123,14 +231,10 @@ class TransactionService:
         # Store the change amount before clearing balance
         change_amount = payment_result["balance"]
         
-        # Decrease stock for all items
-        for item in items_to_purchase:
-            inventory_service.decrease_stock(item['id'])
-        
         # Record transaction
         transaction = {
-            "timestamp": datetime.now().isoformat(),
-            "items": [{"id": item['id'], "name": item['name'], "price": item['price']} for item in items_to_purchase],
+            "timestamp_ns": time.time_ns(),
+            "items": inventory_service.get_line_items(quantities.elements()),
             "total_price": total_price,
             "change": change_amount
         }
@@ -142,16 +246,13 @@ class TransactionService:
         # Clear remaining balance (dispense change)
         vending_machine.clear_balance()
         
-        # Complete dispensing and return to IDLE
-        state_manager.transition(vending_machine, "complete")
-        
-        # Clear selected item
-        vending_machine.set_selected_item(None)
+        # Complete dispensing and return to IDLE (the transition clears the selected item)
+        self._transition(vending_machine, "complete")
         
         return {
             "success": True,
-            "message": f"{len(items_to_purchase)} item(s) dispensed successfully!",
-            "transaction": transaction,
+            "message": f"{sum(quantities.values())} item(s) dispensed successfully!",
+            "transaction": self.render_transaction(transaction),
             "change": change_amount,
             "state": vending_machine.get_state()
         }
@@ -161,10 +262,19 @@ class TransactionService:
         Cancel current transaction and process refund
         Returns all money to user and clears cart
         """
+        # Nothing to give back - skip the REFUND round trip and just settle in IDLE
+        # (runs under the request's machine lock, so no coin can land in between)
+        if not vending_machine.get_balance_cents() and not vending_machine.cart:
+            state_manager.reset_to_idle(vending_machine)
+            return {
+                "success": True,
+                "message": "Nothing to refund",
+                "refund_amount": 0.0,
+                "state": vending_machine.get_state()
+            }
+        
         # Transition to REFUND state
-        success, message, new_state = state_manager.transition(
-            vending_machine, "refund"
-        )
+        success, message, new_state = self._transition(vending_machine, "refund")
         
         if not success:
             return {
@@ -176,12 +286,11 @@ class TransactionService:
         # Process refund
         refund_result = payment_service.process_refund(vending_machine)
         
-        # Clear cart and selected item
+        # Clear cart
         vending_machine.clear_cart()
-        vending_machine.set_selected_item(None)
         
-        # Complete refund and return to IDLE
-        state_manager.transition(vending_machine, "complete")
+        # Complete refund and return to IDLE (the transition clears the selected item)
+        self._transition(vending_machine, "complete")
         
         return {
             "success": True,
@@ -190,14 +299,18 @@ class TransactionService:
             "state": vending_machine.get_state()
         }
     
+    @staticmethod
+    def render_transaction(transaction: Dict) -> Dict:
+        """Response form of a recorded transaction, adding the ISO timestamp"""
+        timestamp_ns = transaction.get("timestamp_ns")
+        if timestamp_ns is None:
+            return transaction
+        return {**transaction, "timestamp": _format_ts(timestamp_ns)}
+    
     def get_transaction_status(self, vending_machine) -> Dict:
         """Get current transaction status"""
         return {
-            "state": vending_machine.get_state(),
-            "balance": vending_machine.get_balance(),
-            "selected_item": vending_machine.get_selected_item(),
-            "cart": vending_machine.get_cart(),
-            "cart_count": len(vending_machine.get_cart()),
+            **vending_machine.snapshot(),
             "available_actions": state_manager.get_available_actions(
                 vending_machine.current_state
             )
@@ -0,0 +1,18 @@
+"""
+Gunicorn Configuration
+Loaded automatically by `gunicorn run:app` from the project directory
+Uses threaded workers so requests blocked on Redis I/O overlap
+"""
+
+import os
+
+# Render (and most PaaS hosts) pass the port in $PORT
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Inventory stock lives in each worker process, so run one worker by default
+# Set WEB_CONCURRENCY to scale out (session state is shared only with REDIS_URL)
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# Each thread handles one request; while one waits on Redis the others run
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
@@ -1,21 +1,33 @@
 """
 Application Entry Point
-Runs the Flask development server
+Runs the app with Waitress when installed, else Flask's threaded server
+Set FLASK_ENV=development for the debugger and auto-reloader
 """
 
+import os
 from app import create_app
 
 # Create Flask application
 app = create_app()
 
 if __name__ == '__main__':
+    debug = os.environ.get('FLASK_ENV') == 'development'
+    port = int(os.environ.get('PORT', '5000'))
+    
     print("=" * 60)
     print("🤖 VENDING MACHINE - MEALY MACHINE IMPLEMENTATION")
     print("=" * 60)
-    print("Server starting on http://localhost:5000")
-    print("API endpoints available at http://localhost:5000/api")
+    print(f"Server starting on http://localhost:{port}")
+    print(f"API endpoints available at http://localhost:{port}/api")
     print("=" * 60)
     
     # Run the application
-    app.run(app.run(debug=True, host='0.0.0.0', port=5000))
-
+    if debug:
+        app.run(debug=True, host='0.0.0.0', port=port)
+    else:
+        try:
+            from waitress import serve
+        except ImportError:  # waitress is optional (Gunicorn is the Linux server)
+            app.run(host='0.0.0.0', port=port, threaded=True)
+        else:
+            serve(app, host='0.0.0.0', port=port, threads=8)
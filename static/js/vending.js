@@ -405,8 +405,8 @@ function renderTransactionHistory(transactions) {
         return;
     }
     
-    // Reverse to show latest first
-    transactions.reverse().forEach(transaction => {
+    // API returns latest first
+    transactions.forEach(transaction => {
         const item = document.createElement('div');
         item.className = 'history-item';
         